@@ -1,108 +1,316 @@
-import os, re, html as html_mod, secrets, traceback, logging
+import os, io, re, secrets, logging, asyncio, hashlib, copy, threading, time, queue, atexit
+import multiprocessing
+from collections import OrderedDict, deque
 from pathlib import Path
+from typing import IO
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
 
 from fastapi import FastAPI, Request, UploadFile, Form
-from fastapi.responses import HTMLResponse, RedirectResponse, Response, PlainTextResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
+from starlette.concurrency import run_in_threadpool
+
+import pdftext
+from pdftext import open_pdf
 
-from PyPDF2 import PdfReader
 from xhtml2pdf import pisa
 
+try:
+    import hyperscan  # optional: one-pass prefilter for the parse regexes
+except ImportError:
+    hyperscan = None
+try:
+    import ahocorasick  # optional: literal prefilter when hyperscan is unavailable
+except ImportError:
+    ahocorasick = None
+
 # ====== Setup ======
 BASE = Path(__file__).parent
 TEMPLATES_DIR = BASE / "templates"
 STATIC_DIR = BASE / "static"
 UPLOADS_DIR = BASE / "uploads"
+REPORTS_DIR = UPLOADS_DIR / "reports"  # written by the app only, so safe to sweep
 
 TEMPLATES_DIR.mkdir(exist_ok=True)
 STATIC_DIR.mkdir(exist_ok=True)
 ( STATIC_DIR / "css" ).mkdir(parents=True, exist_ok=True)
 UPLOADS_DIR.mkdir(exist_ok=True)
+REPORTS_DIR.mkdir(exist_ok=True)
 
 TEMPLATES = Jinja2Templates(directory=str(TEMPLATES_DIR))
+# Templates ship with the app; only re-stat them on every render when editing locally.
+TEMPLATES.env.auto_reload = os.environ.get("TEMPLATES_AUTO_RELOAD", "0") == "1"
+TEMPLATES.env.trim_blocks = True
+TEMPLATES.env.lstrip_blocks = True
+REPORT_TMPL = TEMPLATES.get_template("report.html")
+
+def report_template():
+    # A Template object held directly is never re-checked, so look it up
+    # again when reloading is on.
+    return TEMPLATES.get_template("report.html") if TEMPLATES.env.auto_reload else REPORT_TMPL
 
 APP_PASSWORD = os.environ.get("APP_PASSWORD", "changeme")
 APP_SAFE = os.environ.get("APP_SAFE", "0") == "1"
+KEEP_UPLOADS = os.environ.get("KEEP_UPLOADS", "0") == "1"
+# Processes serving the app, used to share CPUs between them. Only known when
+# set: `python serve.py` exports it to its workers, other launchers may not.
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+# Reports are served from memory first. A copy also goes to REPORTS_DIR (deleted
+# once older than REPORT_TTL_S) for when the follow-up /pdf lands on another
+# worker or the report has left the memory cache. REPORTS_IN_MEMORY_ONLY=1 skips
+# the copy; only safe with a single worker process.
+PERSIST_REPORTS = os.environ.get("REPORTS_IN_MEMORY_ONLY", "0") != "1"
+MAX_PDF_BYTES = int(os.environ.get("MAX_PDF_MB", "25")) * 1024 * 1024
 SESSION_SECRET = os.environ.get("SESSION_SECRET", "dev-secret-change-me")
+SESSION_MAX_AGE = int(os.environ.get("SESSION_MAX_AGE", "3600"))
+SESSION_HTTPS_ONLY = os.environ.get("SESSION_HTTPS_ONLY", "0") == "1"
+# Comma-separated frontend origins. The UI is served same-origin, so CORS is off unless set.
+CORS_ORIGINS = [o.strip() for o in os.environ.get("CORS_ORIGINS", "").split(",") if o.strip()]
 
 logger = logging.getLogger("amicoeco")
-logging.basicConfig(level=logging.INFO)
-
-app = FastAPI(title="Amico Eco • EPC Comparator")
-app.add_middleware(SessionMiddleware, secret_key=SESSION_SECRET)
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_headers=["*"], allow_methods=["*"])
+# Records are queued and written by a listener thread, so logging a traceback
+# (safe_error) never holds the request up on stream I/O.
+_LOG_QUEUE: queue.Queue = queue.Queue(-1)
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+_LOG_LISTENER = QueueListener(_LOG_QUEUE, _log_stream)
+_log_queue_handler = QueueHandler(_LOG_QUEUE)
+_log_queue_handler.setFormatter(logging.Formatter("%(message)s"))  # prefix added once, by _log_stream
+logging.basicConfig(level=logging.INFO, handlers=[_log_queue_handler])
+_LOG_LISTENER.start()
+atexit.register(_LOG_LISTENER.stop)  # flush what is still queued
+
+# PDF renderer for /pdf: "xhtml2pdf" (default, pure Python) or "weasyprint"
+# (native cairo/pango, much faster). WeasyPrint implements far more CSS than
+# xhtml2pdf, so style.css renders closer to the browser; it does not run the
+# template's JavaScript, and needs pango installed on the host.
+PDF_BACKEND = os.environ.get("PDF_BACKEND", "xhtml2pdf").lower()
+if PDF_BACKEND == "weasyprint":
+    try:
+        import weasyprint
+    except (ImportError, OSError):  # OSError when the pango libraries are missing
+        logger.warning("PDF_BACKEND=weasyprint but WeasyPrint is unavailable; using xhtml2pdf", exc_info=True)
+        PDF_BACKEND = "xhtml2pdf"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_page_pool()
+    sweep_reports()
+    yield
+    stop_page_pool()
+
+app = FastAPI(title="Amico Eco • EPC Comparator", lifespan=lifespan)
+app.add_middleware(SessionMiddleware, secret_key=SESSION_SECRET, max_age=SESSION_MAX_AGE,
+                   same_site="lax", https_only=SESSION_HTTPS_ONLY)
+if CORS_ORIGINS:
+    app.add_middleware(CORSMiddleware, allow_origins=CORS_ORIGINS, allow_headers=["*"], allow_methods=["GET", "POST"])
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
 # ====== Helpers ======
 
 STAT_ORDER = ["already installed", "not applicable", "sap increase too small", "recommended"]
 
-def norm_ws(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "")).strip()
-
 def is_authed(request: Request) -> bool:
     return request.session.get("authed") is True
 
+async def read_upload(upload: UploadFile) -> bytes | None:
+    # Returns None when the upload exceeds MAX_PDF_BYTES, buffering at most one byte more.
+    if upload.size is not None and upload.size > MAX_PDF_BYTES:
+        return None
+    data = await upload.read(MAX_PDF_BYTES + 1)
+    return data if len(data) <= MAX_PDF_BYTES else None
+
 def safe_error(e: Exception) -> HTMLResponse:
-    tb = traceback.format_exc()
-    logger.error("Error:\n%s", tb)
-    return HTMLResponse(f"<h2>Internal error</h2><pre>{html_mod.escape(tb)}</pre>", status_code=500)
-
-def extract_text(path: Path) -> str:
-    reader = PdfReader(str(path))
-    pages = []
-    for p in reader.pages:
-        try:
-            pages.append(p.extract_text() or "")
-        except Exception:
-            pages.append("")
-    lines = [norm_ws(ln) for ln in "\n".join(pages).splitlines()]
-    return "\n".join([ln for ln in lines if ln])
+    # The traceback goes to the log only; the page shows an id to find it by.
+    incident = secrets.token_hex(4)
+    logger.exception("Request failed [incident %s]", incident, exc_info=e)
+    return HTMLResponse(f"<h2>Internal error</h2><p>Incident id: {incident}</p>", status_code=500)
+
+# Documents with fewer pages than this are extracted serially. PyMuPDF reads
+# ~1 ms/page; a warm worker costs ~0.3-0.7 ms per range (pickling the bytes and
+# reopening the document), so 8 pages leaves parallel extraction well ahead.
+PARALLEL_MIN_PAGES = 8
+# Wall-clock budget for text extraction. Pathological PDFs stop here and the
+# text gets a TRUNCATED_MARKER line instead of stalling the request. Serial
+# extraction can only check it between pages; with the page pool the request
+# stops waiting at the deadline even if a worker is stuck inside one page.
+EXTRACT_BUDGET_S = float(os.environ.get("EXTRACT_BUDGET_S", "15"))
+TRUNCATED_MARKER = "[TRUNCATED]"
+# Optional cap on pages read per PDF (0, the default, reads them all). A
+# capped document is marked truncated like one that ran out of budget.
+MAX_PDF_PAGES = int(os.environ.get("MAX_PDF_PAGES", "0"))
+# Page-extraction processes per web worker; by default the CPUs are shared
+# between the WEB_CONCURRENCY workers rather than each taking all of them.
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)))
+_PAGE_POOL: ProcessPoolExecutor | None = None
+_PAGE_POOL_LOCK = threading.Lock()  # PRE and POST are extracted concurrently
+
+def _page_pool() -> ProcessPoolExecutor:
+    global _PAGE_POOL
+    with _PAGE_POOL_LOCK:
+        if _PAGE_POOL is None:
+            # Never fork: the server process already runs threadpool and log threads.
+            # Workers unpickle pdftext functions and re-import the launcher's
+            # main module, which is serve.py or uvicorn/gunicorn and never this
+            # app, so they only load PyMuPDF; the fork server preloads it once.
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                ctx = multiprocessing.get_context("forkserver")
+                ctx.set_forkserver_preload(["pdftext"])
+            else:
+                ctx = multiprocessing.get_context("spawn")
+            _PAGE_POOL = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=ctx)
+        return _PAGE_POOL
+
+def start_page_pool() -> None:
+    # Start the workers at startup, not on the first large PDF. Does not wait.
+    if PDF_WORKERS < 2: return
+    pool = _page_pool()
+    for _ in range(PDF_WORKERS):
+        pool.submit(pdftext.warm)
+
+def stop_page_pool() -> None:
+    with _PAGE_POOL_LOCK:
+        if _PAGE_POOL is not None:
+            _PAGE_POOL.shutdown(wait=False, cancel_futures=True)
+
+def _drop_page_pool(pool: ProcessPoolExecutor) -> None:
+    # A pool whose worker died (segfault, OOM killer) refuses all further work;
+    # forget it so _page_pool() builds a fresh one on next use.
+    global _PAGE_POOL
+    with _PAGE_POOL_LOCK:
+        if _PAGE_POOL is pool:  # the other side's extraction may have replaced it already
+            _PAGE_POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _extract_parallel(data: bytes, page_count: int, deadline: float) -> tuple[list[str], int]:
+    pool = _page_pool()
+    step = -(-page_count // PDF_WORKERS)
+    ranges = [(i, min(i + step, page_count)) for i in range(0, page_count, step)]
+    try:
+        futures = [pool.submit(pdftext.extract_pages, data, start, stop, deadline) for start, stop in ranges]
+        lines, done = [], 0
+        for (start, stop), f in zip(ranges, futures):
+            try:
+                chunk, n = f.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                # The worker finishes its page in the background; this document
+                # is reported truncated at the pages read so far.
+                for rest in futures: rest.cancel()
+                break
+            lines.extend(chunk)
+            done += n
+            if n < stop - start:
+                for rest in futures: rest.cancel()
+                break
+    except BrokenProcessPool:
+        logger.warning("A page worker died; rebuilding the pool and reading this PDF serially", exc_info=True)
+        _drop_page_pool(pool)
+        return pdftext.extract_pages(data, 0, page_count, deadline)
+    return lines, done
+
+def _extract(src: Path | bytes | IO[bytes]) -> tuple[str, bool]:
+    # The text, and whether it was cut short by the extraction budget or page cap.
+    if hasattr(src, "read"):
+        src = src.read()
+    # CLOCK_MONOTONIC is system-wide, so page workers can compare against it too.
+    deadline = time.monotonic() + EXTRACT_BUDGET_S
+    doc = open_pdf(src)
+    try:
+        total_pages = doc.page_count
+        page_count = min(total_pages, MAX_PDF_PAGES) if MAX_PDF_PAGES else total_pages
+        parallel = page_count >= PARALLEL_MIN_PAGES and PDF_WORKERS > 1
+        if not parallel:
+            lines, done = pdftext.pages_lines(doc, 0, page_count, deadline)
+    finally:
+        doc.close()
+    if parallel:
+        data = bytes(src) if isinstance(src, (bytes, bytearray)) else Path(src).read_bytes()
+        lines, done = _extract_parallel(data, page_count, deadline)
+    truncated = done < total_pages
+    if truncated:
+        logger.warning("Text extraction stopped after %d of %d pages (%gs budget, %s page cap)",
+                       done, total_pages, EXTRACT_BUDGET_S, MAX_PDF_PAGES or "no")
+        lines.append(TRUNCATED_MARKER)
+    return "\n".join(lines), truncated
+
+def extract_text(src: Path | bytes | IO[bytes]) -> str:
+    return _extract(src)[0]
+
+# (needle, label) pairs probed in STAT_ORDER priority; first hit wins.
+_STATUS_TABLE = tuple((token, token.title()) for token in STAT_ORDER)
+
+@lru_cache(maxsize=512)
+def choose_status(raw: str) -> str:
+    if not raw: return ""
+    txt = raw.lower()
+    for needle, label in _STATUS_TABLE:
+        if needle in txt:
+            return label
+    return raw.strip()
 
 def pick_status(pre_text: str, post_text: str):
-    def choose(raw: str) -> str:
-        txt = (raw or "").lower()
-        for token in STAT_ORDER:
-            if token in txt:
-                return token.title()
-        return raw.strip() if raw else ""
-    return choose(pre_text), choose(post_text)
-
-def _search(pat: str, text: str, cast=str, default=None):
-    m = re.search(pat, text, re.IGNORECASE)
+    return choose_status(pre_text), choose_status(post_text)
+
+def _may_match(pat: re.Pattern, hits: set | None) -> bool:
+    # hits is the prefilter result; None means no prefilter ran.
+    return hits is None or pat in hits
+
+def _find(pat: re.Pattern, text: str, hits: set | None = None):
+    return pat.search(text) if _may_match(pat, hits) else None
+
+def _search(pat: re.Pattern, text: str, cast=str, default=None, hits: set | None = None):
+    m = _find(pat, text, hits)
     if not m: return default
     val = m.group(1).strip()
     try: return cast(val)
     except Exception: return val
 
-def _search_float(pat: str, text: str):
-    m = re.search(pat, text, re.IGNORECASE)
+def _search_float(pat: re.Pattern, text: str, hits: set | None = None):
+    m = _find(pat, text, hits)
     if not m: return None
     v = m.group(1).replace(",", "")
     try: return float(v)
     except Exception: return None
 
-def parse_summary(text: str):
+_SURVEY_REF_RE = re.compile(r"Survey Reference:\s*([A-Za-z0-9\-/ ]+)", re.IGNORECASE)
+_REF_NUMBER_RE = re.compile(r"Reference Number:\s*([A-Za-z0-9\-/]+)", re.IGNORECASE)
+_PROCESS_DATE_RE = re.compile(r"Process date:\s*([0-9]{2}/[0-9]{2}/[0-9]{4})", re.IGNORECASE)
+_SAP_RE = re.compile(r"Current SAP rating:\s*([A-G])\s*(\d+)\s*Potential SAP rating:\s*([A-G])\s*(\d+)", re.IGNORECASE)
+_EI_RE = re.compile(r"Current EI rating:\s*([A-G])\s*(\d+)\s*Potential EI rating:\s*([A-G])\s*(\d+)", re.IGNORECASE)
+_FUEL_BILL_RE = re.compile(r"(?:Fuel Bill|Estimated Fuel Costs?)\s*:\s*£?\s*([\d,]+(?:\.\d+)?)", re.IGNORECASE)
+_UPRN_RE = re.compile(r"UPRN:\s*([A-Za-z0-9\-]+)", re.IGNORECASE)
+_POSTCODE_RE = re.compile(r"\b([A-Z]{1,2}\d{1,2}[A-Z]?\s*\d[A-Z]{2})\b", re.IGNORECASE)
+_ADDRESS_RE = re.compile(r"Address\s*:\s*(.+?)\s*(?:UPRN|Postcode|$)", re.IGNORECASE)
+
+# Summary fields stay as one search per field rather than one combined
+# alternation: each search stops at its first hit, whereas a combined
+# finditer has to walk the whole text (and trying Address/Postcode at every
+# offset dominates). Measured on EPC text, the combined form was ~20x slower.
+def parse_summary(text: str, hits: set | None = None):
     d = {}
-    d["survey_reference"] = _search(r"Survey Reference:\s*([A-Za-z0-9\-/ ]+)", text)
-    d["reference_number"] = _search(r"Reference Number:\s*([A-Za-z0-9\-/]+)", text)
-    d["process_date"]     = _search(r"Process date:\s*([0-9]{2}/[0-9]{2}/[0-9]{4})", text)
-    sap = re.search(r"Current SAP rating:\s*([A-G])\s*(\d+)\s*Potential SAP rating:\s*([A-G])\s*(\d+)", text, re.IGNORECASE)
+    d["survey_reference"] = _search(_SURVEY_REF_RE, text, hits=hits)
+    d["reference_number"] = _search(_REF_NUMBER_RE, text, hits=hits)
+    d["process_date"]     = _search(_PROCESS_DATE_RE, text, hits=hits)
+    sap = _SAP_RE.search(text) if _may_match(_SAP_RE, hits) else None
     if sap:
         d["sap_current_band"], d["sap_current"] = sap.group(1), int(sap.group(2))
         d["sap_potential_band"], d["sap_potential"] = sap.group(3), int(sap.group(4))
-    ei = re.search(r"Current EI rating:\s*([A-G])\s*(\d+)\s*Potential EI rating:\s*([A-G])\s*(\d+)", text, re.IGNORECASE)
+    ei = _EI_RE.search(text) if _may_match(_EI_RE, hits) else None
     if ei:
         d["ei_current_band"], d["ei_current"] = ei.group(1), int(ei.group(2))
         d["ei_potential_band"], d["ei_potential"] = ei.group(3), int(ei.group(4))
-    d["fuel_bill"] = _search_float(r"(?:Fuel Bill|Estimated Fuel Costs?)\s*:\s*£?\s*([\d,]+(?:\.\d+)?)", text)
-    d["uprn"] = _search(r"UPRN:\s*([A-Za-z0-9\-]+)", text)
-    d["postcode"] = _search(r"\b([A-Z]{1,2}\d{1,2}[A-Z]?\s*\d[A-Z]{2})\b", text)
-    d["address"] = _search(r"Address\s*:\s*(.+?)\s*(?:UPRN|Postcode|$)", text)
+    d["fuel_bill"] = _search_float(_FUEL_BILL_RE, text, hits=hits)
+    d["uprn"] = _search(_UPRN_RE, text, hits=hits)
+    d["postcode"] = _search(_POSTCODE_RE, text, hits=hits)
+    d["address"] = _search(_ADDRESS_RE, text, hits=hits)
     return d
 
 AREA_LABELS = [
@@ -110,15 +318,44 @@ AREA_LABELS = [
     "1st Floor","First Floor","Ground Floor","2nd Floor","Second Floor","Total Floor Area"
 ]
 
-def parse_numeric_measures(text: str):
+# re.IGNORECASE also matches i against İ/ı and s against ſ (K already lowers to
+# k); folding those first makes plain lowered text match the same labels, and
+# keeps len(low) == len(text), since "İ".lower() is two characters.
+_LOWER_FOLD = {"İ": "i", "ı": "i", "ſ": "s"}
+_LOWER_FOLD_RE = re.compile("[" + "".join(_LOWER_FOLD) + "]")
+
+def fold_lower(text: str) -> str:
+    if not text.isascii() and _LOWER_FOLD_RE.search(text):
+        text = _LOWER_FOLD_RE.sub(lambda m: _LOWER_FOLD[m.group()], text)
+    return text.lower()
+
+# One alternation over every label, so the text is scanned once rather than
+# once per label. It is matched case-sensitively against fold_lower(text):
+# re.IGNORECASE on an alternation is slower than the separate searches it
+# replaces, while a plain alternation over lowered text is ~3x faster.
+# Matches are mapped back to the canonical label spelling.
+_AREA_CANON = {label.lower(): label for label in AREA_LABELS}
+_MEASURES_RE = re.compile(
+    r"(" + "|".join(re.escape(label) for label in _AREA_CANON) + r")\s*:\s*([0-9]+(?:\.[0-9]+)?)"
+)
+
+def parse_numeric_measures(text: str, hits: set | None = None, low: str | None = None):
+    # low: fold_lower(text), if the caller already has it.
     m = {}
-    for label in AREA_LABELS:
-        pat = rf"{re.escape(label)}\s*:\s*([0-9]+(?:\.[0-9]+)?)"
-        mm = re.search(pat, text, re.IGNORECASE)
-        if mm:
-            try: m[label] = float(mm.group(1))
+    if not _may_match(_MEASURES_RE, hits): return m
+    if low is None: low = fold_lower(text)
+    found = _MEASURES_RE.search(low)
+    while found:
+        label = _AREA_CANON[found.group(1)]
+        if label not in m:
+            try: m[label] = float(found.group(2))
             except: pass
-    return m
+        # A value can run into the next label ("...: 2nd Floor: 40" reads "2").
+        # Resume at the value rather than after it so that label is still
+        # found, as the per-label searches found it. Nothing else in a match can
+        # hold a label: none contains another or ends in ":".
+        found = _MEASURES_RE.search(low, found.start(2))
+    return {label: m[label] for label in AREA_LABELS if label in m}
 
 REC_NAMES = [
     "Flat roof insulation","Room-in-roof insulation","Floor insulation (solid floor)",
@@ -126,24 +363,40 @@ REC_NAMES = [
     "Cavity wall insulation","Draught proofing","Low energy lighting",
 ]
 
-def parse_recommendations(text: str):
+# Same lowered-text alternation as _MEASURES_RE. Only the match positions come
+# from the lowered text: statuses are sliced from the original, as title() of a
+# lowered string can differ ("İx" lowers to "i̇x").
+_REC_CANON = {name.lower(): name for name in REC_NAMES}
+_RECS_RE = re.compile(
+    r"(" + "|".join(re.escape(name) for name in _REC_CANON) + r")\s*\(([^)]+)\)"
+)
+
+def parse_recommendations(text: str, hits: set | None = None, low: str | None = None):
     recs = {}
-    for name in REC_NAMES:
-        pat = rf"{re.escape(name)}\s*\(([^)]+)\)"
-        m = re.search(pat, text, re.IGNORECASE)
-        if m: recs[name] = m.group(1).strip().title()
-    return recs
+    if not _may_match(_RECS_RE, hits): return recs
+    if low is None: low = fold_lower(text)  # same length as text, so offsets carry over
+    m = _RECS_RE.search(low)
+    while m:
+        name = _REC_CANON[m.group(1)]
+        if name not in recs: recs[name] = text[m.start(2):m.end(2)].strip().title()
+        # Likewise [^)]+ runs on past an unclosed "(" and can swallow the next
+        # name; resume inside the status.
+        m = _RECS_RE.search(low, m.start(2))
+    return {name: recs[name] for name in REC_NAMES if name in recs}
 
 # ====== Site-notes parsing & QA checks ======
 YES_TOKENS = {"y", "yes", "true", "present", "installed", "fitted", "exists", "smart", "on"}
 NO_TOKENS  = {"n", "no", "false", "absent", "none", "not present", "off"}
+_BOOL_MAP = {t: True for t in YES_TOKENS} | {t: False for t in NO_TOKENS}
+# float() already ignores surrounding whitespace, so only thousands separators need removing.
+_FLOAT_TRANS = str.maketrans("", "", ",")
 
 def to_bool(raw) -> bool | None:
     if raw is None:
         return None
     s = str(raw).strip().lower()
-    if s in YES_TOKENS: return True
-    if s in NO_TOKENS:  return False
+    exact = _BOOL_MAP.get(s)
+    if exact is not None: return exact
     if any(tok in s for tok in YES_TOKENS): return True
     if any(tok in s for tok in NO_TOKENS):  return False
     return None
@@ -151,8 +404,7 @@ def to_bool(raw) -> bool | None:
 def to_float(raw) -> float | None:
     if raw is None: return None
     try:
-        s = str(raw).replace(",", "").strip()
-        return float(s)
+        return float(str(raw).translate(_FLOAT_TRANS))
     except:
         return None
 
@@ -160,40 +412,57 @@ def to_int(raw) -> int | None:
     v = to_float(raw)
     return int(v) if v is not None else None
 
-def parse_site_notes(text: str) -> dict:
+_SMART_GAS_RE = re.compile(r"smart\s+gas\s+meter(?:\s*[:\-]?\s*(yes|no|present|absent|true|false|on|off))?", re.I)
+_SMART_ELEC_RE = re.compile(r"smart\s+electric(\w*)\s+meter(?:\s*[:\-]?\s*(yes|no|present|absent|true|false|on|off))?", re.I)
+_LOFT_RE = re.compile(r"loft\s+insulation(?:\s*[:\-]?\s*(\d+)\s*mm)?", re.I)
+_CAVITY_RE = re.compile(r"(?:cavity|cav)\s+wall\s+insulation(?:\s*[:\-]?\s*(yes|no|present|absent|true|false))?", re.I)
+_IWI_RE = re.compile(r"(internal|solid)\s+wall\s+insulation(?:\s*[:\-]?\s*(\d+)\s*mm)?", re.I)
+_FLAT_ROOF_RE = re.compile(r"flat\s+roof\s+insulation(?:\s*[:\-]?\s*(yes|no|present|absent|true|false))?", re.I)
+_MECH_VENT_RE = re.compile(r"\bMEV\b|\bdecentralised\s+extract\b|\bMVHR\b|\bmechanical\s+ventilation\b", re.I)
+_AP4_RE = re.compile(r"(?:air\s*pressure|AP4)[^0-9]*([0-9]+(?:\.[0-9]+)?)", re.I)
+_DOUBLE_GLAZ_RE = re.compile(r"double\s+glaz(ed|ing)(?:\s*[:\-]?\s*(yes|no))?", re.I)
+_DOORS_RE = re.compile(r"doors?\s*[:\-]?\s*(\d+)\s*\(uninsulated\)", re.I)
+_LOW_ENERGY_RE = re.compile(r"(\d+)\s+low[- ]energy\s+of\s+(\d+)", re.I)
+_MAIN_HEAT_RE = re.compile(r"main\s+heating\s+system.*?(\d{2,3}\.\d)%", re.I)
+_HEAT_CONTROLS_RE = re.compile(r"heating\s+controls?.*?(smart|zoned|trv|programm(er|able)|room\s*thermostat)", re.I)
+_HOT_WATER_RE = re.compile(r"water\s+heating.*?(cylinder|combi|no\s+cylinder)", re.I)
+_PV_RE = re.compile(r"\bsolar\s+pv\b|\bphotovoltaic\b", re.I)
+_SMART_CONTROLS_RE = re.compile(r"smart|zoned|trv", re.I)
+
+def parse_site_notes(text: str, hits: set | None = None) -> dict:
     out = {}
-    m = re.search(r"smart\s+gas\s+meter(?:\s*[:\-]?\s*(yes|no|present|absent|true|false|on|off))?", text, re.I)
+    m = _find(_SMART_GAS_RE, text, hits)
     out["smart_gas_meter"] = to_bool(m.group(1) if m and m.lastindex else (m.group(0) if m else None))
 
-    m = re.search(r"smart\s+electric(\w*)\s+meter(?:\s*[:\-]?\s*(yes|no|present|absent|true|false|on|off))?", text, re.I)
+    m = _find(_SMART_ELEC_RE, text, hits)
     out["smart_elec_meter"] = to_bool(m.group(1) if m and m.lastindex else (m.group(0) if m else None))
 
-    m = re.search(r"loft\s+insulation(?:\s*[:\-]?\s*(\d+)\s*mm)?", text, re.I)
+    m = _find(_LOFT_RE, text, hits)
     out["loft_insulation_mm"] = to_int(m.group(1)) if m and m.lastindex else None
     out["loft_insulated"] = (out["loft_insulation_mm"] is not None and out["loft_insulation_mm"] > 0)
 
-    m = re.search(r"(?:cavity|cav)\s+wall\s+insulation(?:\s*[:\-]?\s*(yes|no|present|absent|true|false))?", text, re.I)
+    m = _find(_CAVITY_RE, text, hits)
     out["cavity_wall_insulation"] = to_bool(m.group(1) if m and m.lastindex else (m.group(0) if m else None))
 
-    m = re.search(r"(internal|solid)\s+wall\s+insulation(?:\s*[:\-]?\s*(\d+)\s*mm)?", text, re.I)
+    m = _find(_IWI_RE, text, hits)
     out["internal_wall_insulation_mm"] = to_int(m.group(2)) if m and m.lastindex and m.group(2) else None
 
-    m = re.search(r"flat\s+roof\s+insulation(?:\s*[:\-]?\s*(yes|no|present|absent|true|false))?", text, re.I)
+    m = _find(_FLAT_ROOF_RE, text, hits)
     out["flat_roof_insulated"] = to_bool(m.group(1) if m and m.lastindex else (m.group(0) if m else None))
 
-    m = re.search(r"\bMEV\b|\bdecentralised\s+extract\b|\bMVHR\b|\bmechanical\s+ventilation\b", text, re.I)
+    m = _find(_MECH_VENT_RE, text, hits)
     out["mechanical_ventilation"] = bool(m)
 
-    m = re.search(r"(?:air\s*pressure|AP4)[^0-9]*([0-9]+(?:\.[0-9]+)?)", text, re.I)
+    m = _find(_AP4_RE, text, hits)
     out["air_permeability_ap4"] = to_float(m.group(1)) if m else None
 
-    m = re.search(r"double\s+glaz(ed|ing)(?:\s*[:\-]?\s*(yes|no))?", text, re.I)
+    m = _find(_DOUBLE_GLAZ_RE, text, hits)
     out["double_glazed"] = to_bool(m.group(2)) if m and m.lastindex and m.group(2) else bool(m)
 
-    m = re.search(r"doors?\s*[:\-]?\s*(\d+)\s*\(uninsulated\)", text, re.I)
+    m = _find(_DOORS_RE, text, hits)
     out["doors_uninsulated"] = to_int(m.group(1)) if m else None
 
-    m = re.search(r"(\d+)\s+low[- ]energy\s+of\s+(\d+)", text, re.I)
+    m = _find(_LOW_ENERGY_RE, text, hits)
     if m:
         out["low_energy_lights"] = to_int(m.group(1))
         out["lights_total"] = to_int(m.group(2))
@@ -201,16 +470,16 @@ def parse_site_notes(text: str) -> dict:
         out["low_energy_lights"] = None
         out["lights_total"] = None
 
-    m = re.search(r"main\s+heating\s+system.*?(\d{2,3}\.\d)%", text, re.I)
+    m = _find(_MAIN_HEAT_RE, text, hits)
     out["main_heat_eff_pct"] = to_float(m.group(1)) if m else None
 
-    m = re.search(r"heating\s+controls?.*?(smart|zoned|trv|programm(er|able)|room\s*thermostat)", text, re.I)
-    out["heating_controls_smart"] = bool(m and re.search(r"smart|zoned|trv", m.group(0), re.I))
+    m = _find(_HEAT_CONTROLS_RE, text, hits)
+    out["heating_controls_smart"] = bool(m and _SMART_CONTROLS_RE.search(m.group(0)))
 
-    m = re.search(r"water\s+heating.*?(cylinder|combi|no\s+cylinder)", text, re.I)
+    m = _find(_HOT_WATER_RE, text, hits)
     out["hot_water_type"] = m.group(1).lower() if m else None
 
-    m = re.search(r"\bsolar\s+pv\b|\bphotovoltaic\b", text, re.I)
+    m = _find(_PV_RE, text, hits)
     out["pv_present"] = bool(m)
 
     return out
@@ -271,16 +540,234 @@ def compare_site_notes(pre: dict, post: dict) -> list[dict]:
 
     return issues
 
-def gather(path: Path):
-    raw = extract_text(path)
-    text = "\n".join([norm_ws(x) for x in raw.splitlines()])
-    return {
-        "summary": parse_summary(text),
-        "measures": parse_numeric_measures(text),
-        "recs": parse_recommendations(text),
-        "notes": parse_site_notes(text),
-        "raw_text": text,
+# ====== Parse prefilter ======
+# The text is scanned once up front to find which parse patterns can match
+# at all; the Python searches for the rest are skipped. With hyperscan every
+# pattern is compiled into one PREFILTER database; failing that, an
+# Aho-Corasick automaton looks for the fixed text each pattern requires, and
+# with neither installed each of those literals gets a plain `in` test. All
+# only ever over-report, so results are identical with or without them (for
+# hyperscan, once the text is folded as below).
+_PREFILTER_LITERALS = {
+    _SURVEY_REF_RE: ("survey reference:",),
+    _REF_NUMBER_RE: ("reference number:",),
+    _PROCESS_DATE_RE: ("process date:",),
+    _SAP_RE: ("current sap rating:",),
+    _EI_RE: ("current ei rating:",),
+    _FUEL_BILL_RE: ("fuel bill", "estimated fuel cost"),
+    _UPRN_RE: ("uprn:",),
+    _POSTCODE_RE: (),  # no fixed text, always searched
+    _ADDRESS_RE: ("address",),
+    _MEASURES_RE: tuple(label.lower() for label in AREA_LABELS),
+    _RECS_RE: tuple(name.lower() for name in REC_NAMES),
+    # site notes allow \s+ (line breaks included) between words: single words only
+    _SMART_GAS_RE: ("meter",),
+    _SMART_ELEC_RE: ("meter",),
+    _LOFT_RE: ("loft",),
+    _CAVITY_RE: ("cav",),
+    _IWI_RE: ("internal", "solid"),
+    _FLAT_ROOF_RE: ("flat",),
+    _MECH_VENT_RE: ("mev", "decentralised", "mvhr", "mechanical"),
+    _AP4_RE: ("pressure", "ap4"),
+    _DOUBLE_GLAZ_RE: ("glaz",),
+    _DOORS_RE: ("(uninsulated)",),
+    _LOW_ENERGY_RE: ("low-energy", "low energy"),
+    _MAIN_HEAT_RE: ("main",),
+    _HEAT_CONTROLS_RE: ("control",),
+    _HOT_WATER_RE: ("water",),
+    _PV_RE: ("pv", "photovoltaic"),
+}
+_PREFILTER_PATS = list(_PREFILTER_LITERALS)
+_PREFILTER_ALWAYS = frozenset(p for p, lits in _PREFILTER_LITERALS.items() if not lits)
+
+def _build_literal_prefilter():
+    if ahocorasick is None: return None
+    owners: dict[str, list] = {}
+    for pat, literals in _PREFILTER_LITERALS.items():
+        for lit in literals:
+            owners.setdefault(lit, []).append(pat)
+    automaton = ahocorasick.Automaton()
+    for lit, pats in owners.items():
+        automaton.add_word(lit, tuple(pats))
+    automaton.make_automaton()
+    return automaton
+
+def _build_prefilter():
+    if hyperscan is None: return None
+    flags = (hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_PREFILTER | hyperscan.HS_FLAG_SINGLEMATCH
+             | hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP | hyperscan.HS_FLAG_ALLOWEMPTY)
+    db = hyperscan.Database()
+    try:
+        db.compile(
+            expressions=[p.pattern.encode("utf-8") for p in _PREFILTER_PATS],
+            ids=list(range(len(_PREFILTER_PATS))),
+            flags=[flags] * len(_PREFILTER_PATS),
+        )
+    except hyperscan.error:
+        logger.warning("Hyperscan could not compile the parse patterns; prefilter disabled", exc_info=True)
+        return None
+    return db
+
+_PREFILTER_DB = _build_prefilter()
+# re.IGNORECASE also equates these letters with ASCII ones, and re's \s takes
+# in these spaces; hyperscan's CASELESS/UCP does neither. Folding them in the
+# scanned copy keeps its matches a superset of re's.
+_PREFILTER_FOLD = {"İ": "i", "ı": "i", "ſ": "s", "K": "k"} | {
+    chr(cp): " " for cp in range(0x3001) if chr(cp).isspace() and chr(cp) not in " \t\n\r\f\v"}
+_PREFILTER_FOLD_RE = re.compile("[" + "".join(map(re.escape, _PREFILTER_FOLD)) + "]")
+_PREFILTER_AC = _build_literal_prefilter() if _PREFILTER_DB is None else None
+_PREFILTER_LOCAL = threading.local()  # a scratch space may only be used by one scan at a time
+
+def prefilter(text: str, low: str | None = None) -> set:
+    # low: fold_lower(text), if the caller already has it.
+    if _PREFILTER_DB is None:
+        # Literals are lowercase ASCII; fold_lower() matches them as re.I would.
+        if low is None: low = fold_lower(text)
+        if _PREFILTER_AC is None:
+            return {pat for pat, lits in _PREFILTER_LITERALS.items()
+                    if not lits or any(lit in low for lit in lits)}
+        hits = set(_PREFILTER_ALWAYS)
+        for _, pats in _PREFILTER_AC.iter(low):
+            hits.update(pats)
+        return hits
+    scratch = getattr(_PREFILTER_LOCAL, "scratch", None)
+    if scratch is None:
+        scratch = _PREFILTER_LOCAL.scratch = hyperscan.Scratch(_PREFILTER_DB)
+    hits = set()
+    def on_match(pat_id, start, end, flags, context):
+        hits.add(_PREFILTER_PATS[pat_id])
+    if _PREFILTER_FOLD_RE.search(text):
+        text = _PREFILTER_FOLD_RE.sub(lambda m: _PREFILTER_FOLD[m.group()], text)
+    # Broken ToUnicode maps can leave lone surrogates in the text. "?" matches
+    # everything a surrogate could, so replacing them keeps the over-reporting.
+    _PREFILTER_DB.scan(text.encode("utf-8", errors="replace"), match_event_handler=on_match, scratch=scratch)
+    return hits
+
+def _parse_pdf(data: bytes, include_raw: bool = False) -> tuple[dict, bool]:
+    # Also returns whether extraction was truncated; such results are partial
+    # (and depend on load), so gather() does not cache them.
+    text, truncated = _extract(data)  # already whitespace-normalised, one line per entry
+    low = fold_lower(text)  # shared by the lowered-text parsers and the literal prefilter
+    hits = prefilter(text, low)
+    out = {
+        "summary": parse_summary(text, hits),
+        "measures": parse_numeric_measures(text, hits, low),
+        "recs": parse_recommendations(text, hits, low),
+        "notes": parse_site_notes(text, hits),
+        "truncated": truncated,
     }
+    if include_raw:
+        out["raw_text"] = text
+    return out, truncated
+
+# Parsed results keyed by a hash of the PDF bytes, so re-uploading the same
+# document skips extraction entirely. Oldest entries are dropped first.
+GATHER_CACHE_SIZE = 64
+_GATHER_CACHE: OrderedDict[bytes, dict] = OrderedDict()
+_GATHER_LOCK = threading.Lock()
+
+def gather(data: bytes | IO[bytes], include_raw: bool = False):
+    # include_raw adds the full extracted text under "raw_text" for debugging;
+    # those results bypass the cache so it never holds whole documents.
+    if hasattr(data, "read"):
+        data = data.read()
+    if include_raw:
+        return _parse_pdf(data, include_raw=True)[0]
+    key = hashlib.blake2b(data, digest_size=16).digest()
+    with _GATHER_LOCK:
+        result = _GATHER_CACHE.get(key)
+        if result is not None:
+            _GATHER_CACHE.move_to_end(key)
+    if result is None:
+        result, truncated = _parse_pdf(data)
+        if not truncated:
+            with _GATHER_LOCK:
+                _GATHER_CACHE[key] = result
+                while len(_GATHER_CACHE) > GATHER_CACHE_SIZE:
+                    _GATHER_CACHE.popitem(last=False)
+    # Callers patch the summary in place, so never hand out the cached dict.
+    return copy.deepcopy(result)
+
+# Recently rendered reports by token, oldest first, as (stored_at, html).
+# Only touched from the event loop thread, so no lock is needed.
+REPORT_CACHE_SIZE = 32
+REPORT_TTL_S = SESSION_MAX_AGE
+_REPORT_CACHE: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+def _prune_reports(now: float) -> None:
+    while len(_REPORT_CACHE) > REPORT_CACHE_SIZE:
+        _REPORT_CACHE.popitem(last=False)
+    while _REPORT_CACHE and now - next(iter(_REPORT_CACHE.values()))[0] > REPORT_TTL_S:
+        _REPORT_CACHE.popitem(last=False)
+
+def cache_report(token: str, html_str: str) -> None:
+    now = time.monotonic()
+    _REPORT_CACHE[token] = (now, html_str)
+    _prune_reports(now)
+
+def cached_report(token: str) -> str | None:
+    _prune_reports(time.monotonic())
+    entry = _REPORT_CACHE.get(token)
+    return entry[1] if entry else None
+
+# Report files this process wrote, oldest first, as (written_at, path). Each
+# write deletes those past REPORT_TTL_S, which outlive any session that could
+# fetch them; sweep_reports() clears what earlier processes left behind.
+_REPORT_FILES: deque[tuple[float, Path]] = deque()
+_REPORT_FILES_LOCK = threading.Lock()
+
+def write_report(token: str, html_str: str) -> None:
+    # Blocking; run in the threadpool.
+    path = REPORTS_DIR / f"report_{token}.html"
+    path.write_text(html_str, encoding="utf-8")
+    expired = []
+    with _REPORT_FILES_LOCK:
+        now = time.monotonic()
+        _REPORT_FILES.append((now, path))
+        while _REPORT_FILES and now - _REPORT_FILES[0][0] > REPORT_TTL_S:
+            expired.append(_REPORT_FILES.popleft()[1])
+    for old in expired:
+        old.unlink(missing_ok=True)
+
+def sweep_reports() -> None:
+    # At startup: remove expired reports left by earlier processes. Other
+    # workers' live reports are younger than REPORT_TTL_S and stay.
+    cutoff = time.time() - REPORT_TTL_S
+    for old in REPORTS_DIR.glob("report_*.html"):
+        try:
+            if old.stat().st_mtime < cutoff: old.unlink()
+        except FileNotFoundError:
+            pass  # removed by another worker meanwhile
+
+# PDFs at least this big are streamed from the render buffer in chunks rather
+# than copied out whole with getvalue().
+STREAM_PDF_MIN_BYTES = 1 << 20
+PDF_CHUNK_BYTES = 1 << 16
+
+def _weasy_url_fetcher(url: str):
+    # Reports link assets as /static/...; serve those from STATIC_DIR.
+    path = url.split("://", 1)[-1]
+    if path.startswith("/static/"):
+        url = (STATIC_DIR / path[len("/static/"):]).as_uri()
+    return weasyprint.default_url_fetcher(url)
+
+def render_pdf(html_str: str) -> io.BytesIO | None:
+    # Returns the rendered PDF, or None if the renderer reported a failure.
+    buf = io.BytesIO()
+    if PDF_BACKEND == "weasyprint":
+        weasyprint.HTML(string=html_str, base_url=BASE.as_uri() + "/",
+                        url_fetcher=_weasy_url_fetcher).write_pdf(buf)
+        return buf
+    result = pisa.CreatePDF(src=html_str, dest=buf)
+    return None if result.err else buf
+
+async def iter_buffer(buf: io.BytesIO):
+    view = buf.getbuffer()
+    try:
+        for i in range(0, len(view), PDF_CHUNK_BYTES):
+            yield bytes(view[i:i + PDF_CHUNK_BYTES])
+    finally:
+        view.release()
 
 # ====== Routes ======
 
@@ -319,16 +806,25 @@ async def compare(
         if not pre.filename or not post.filename:
             return HTMLResponse("<h3>Please attach both PRE and POST PDFs.</h3>", status_code=400)
 
-        pre_path = UPLOADS_DIR / f"pre_{pre.filename}"
-        post_path = UPLOADS_DIR / f"post_{post.filename}"
-        pre_path.write_bytes(await pre.read())
-        post_path.write_bytes(await post.read())
+        pre_bytes, post_bytes = await asyncio.gather(read_upload(pre), read_upload(post))
+        if pre_bytes is None or post_bytes is None:
+            return HTMLResponse(f"<h3>PDFs must be {MAX_PDF_BYTES // (1024 * 1024)} MB or smaller.</h3>", status_code=413)
+        if KEEP_UPLOADS:
+            # Audit trail only; parsing works straight from memory. Only the base
+            # name of the client's filename is used, so it cannot leave UPLOADS_DIR.
+            await asyncio.gather(
+                run_in_threadpool((UPLOADS_DIR / f"pre_{Path(pre.filename).name}").write_bytes, pre_bytes),
+                run_in_threadpool((UPLOADS_DIR / f"post_{Path(post.filename).name}").write_bytes, post_bytes),
+            )
 
         pre_data = {"summary": {}, "measures": {}, "recs": {}, "notes": {}}
         post_data = {"summary": {}, "measures": {}, "recs": {}, "notes": {}}
         if not APP_SAFE:
-            pre_data = gather(pre_path)
-            post_data = gather(post_path)
+            # Parsing is blocking; keep it off the event loop and run both sides at once.
+            pre_data, post_data = await asyncio.gather(
+                run_in_threadpool(gather, pre_bytes),
+                run_in_threadpool(gather, post_bytes),
+            )
 
         if pre_date:  pre_data["summary"]["process_date"]  = pre_date
         if post_date: post_data["summary"]["process_date"] = post_date
@@ -346,30 +842,36 @@ async def compare(
             "sap_change": delta(pre_data["summary"].get("sap_current"), post_data["summary"].get("sap_current")),
             "ei_change": delta(pre_data["summary"].get("ei_current"), post_data["summary"].get("ei_current")),
             "fuel_bill_change": delta(pre_data["summary"].get("fuel_bill"), post_data["summary"].get("fuel_bill")),
-            "recs": {}, "areas": {},
         }
-        for n in sorted(set(list(pre_data["recs"].keys()) + list(post_data["recs"].keys()))):
-            p, q = pick_status(pre_data["recs"].get(n, ""), post_data["recs"].get(n, ""))
-            diff["recs"][n] = {"pre": p, "post": q}
-
-        for label in sorted(set(list(pre_data["measures"].keys()) + list(post_data["measures"].keys()))):
-            a = pre_data["measures"].get(label); b = post_data["measures"].get(label)
-            def d(x,y):
-                if x is None or y is None: return None
-                return round(y - x, 2)
-            diff["areas"][label] = {"pre": a, "post": b, "delta": d(a, b)}
+        # Flat (name, pre, post[, delta]) rows so the template needs no nested lookups.
+        pre_recs, post_recs = pre_data["recs"], post_data["recs"]
+        rec_rows = [(n, *pick_status(pre_recs.get(n, ""), post_recs.get(n, "")))
+                    for n in sorted(pre_recs.keys() | post_recs.keys())]
+
+        pre_areas, post_areas = pre_data["measures"], post_data["measures"]
+        area_rows = []
+        for label in sorted(pre_areas.keys() | post_areas.keys()):
+            a, b = pre_areas.get(label), post_areas.get(label)
+            d = delta(a, b)
+            area_rows.append((label, a, b, None if d is None else round(d, 2)))
 
         qa_flags = compare_site_notes(pre_data.get("notes", {}), post_data.get("notes", {}))
+        for side, data in (("PRE", pre_data), ("POST", post_data)):
+            if data.get("truncated"):
+                qa_flags.insert(0, {"level": "warning", "field": f"{side} PDF",
+                                    "message": "Only part of this PDF was read (time budget or page cap); "
+                                               "figures from later pages may be missing."})
 
         now = datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")
-        html_str = TEMPLATES.get_template("report.html").render(
+        html_str = report_template().render(
             request=request, now=now, pre=pre_data, post=post_data, diff=diff, header=header,
-            qa_flags=qa_flags
+            rec_rows=rec_rows, area_rows=area_rows, qa_flags=qa_flags
         )
 
         token = secrets.token_hex(8)
-        html_file = UPLOADS_DIR / f"report_{token}.html"
-        html_file.write_text(html_str, encoding="utf-8")
+        cache_report(token, html_str)
+        if PERSIST_REPORTS:
+            await run_in_threadpool(write_report, token, html_str)
         request.session["last_token"] = token
 
         return HTMLResponse(content=html_str)
@@ -384,19 +886,24 @@ async def pdf(request: Request):
         return RedirectResponse("/", status_code=302)
     try:
         token = request.session.get("last_token")
-        html_file = (UPLOADS_DIR / f"report_{token}.html") if token else None
-        html_str = html_file.read_text(encoding="utf-8") if (html_file and html_file.exists()) else None
+        html_str = cached_report(token) if token else None
+        if html_str is None and token:
+            html_file = REPORTS_DIR / f"report_{token}.html"
+            if html_file.exists():
+                html_str = await run_in_threadpool(html_file.read_text, encoding="utf-8")
         if not html_str:
             return HTMLResponse("<h3>No report available. Please generate a comparison first.</h3>", status_code=400)
 
-        pdf_bytes = bytearray()
-        result = pisa.CreatePDF(src=html_str, dest=pdf_bytes)
-        if result.err:
+        buf = await run_in_threadpool(render_pdf, html_str)
+        if buf is None:
             return HTMLResponse("<h3>PDF generation failed. Try Print → Save as PDF.</h3>", status_code=500)
 
-        return Response(bytes(pdf_bytes), media_type="application/pdf", headers={
-            "Content-Disposition": "attachment; filename=epc_comparison.pdf"
-        })
+        headers = {"Content-Disposition": "attachment; filename=epc_comparison.pdf"}
+        size = buf.getbuffer().nbytes
+        if size >= STREAM_PDF_MIN_BYTES:
+            headers["Content-Length"] = str(size)
+            return StreamingResponse(iter_buffer(buf), media_type="application/pdf", headers=headers)
+        return Response(buf.getvalue(), media_type="application/pdf", headers=headers)
     except Exception as e:
         return safe_error(e)
 
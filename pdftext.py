@@ -0,0 +1,70 @@
+# PDF text extraction, kept apart from app.py so the page-pool worker
+# processes only import PyMuPDF (or pypdf), not the whole web app. That
+# also needs app.py not to be the main module; python serve.py launches it.
+import io, time
+from pathlib import Path
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:  # pure-Python fallback, several times slower
+    fitz = None
+    from pypdf import PdfReader
+
+def norm_ws(s: str) -> str:
+    # str.split() collapses the same runs of (Unicode) whitespace as \s+, in C.
+    return " ".join(s.split()) if s else ""
+
+class _PypdfDocument:
+    """Just enough of fitz.Document for extract_text when PyMuPDF is missing."""
+    def __init__(self, src: Path | bytes):
+        # We own the stream: older PdfReader (e.g. pypdf 4.2) has no close().
+        self._stream = io.BytesIO(src) if isinstance(src, (bytes, bytearray)) else open(src, "rb")
+        try:
+            self._reader = PdfReader(self._stream)
+            self.page_count = len(self._reader.pages)
+        except Exception:
+            self._stream.close()
+            raise
+    def __getitem__(self, i: int):
+        return self._reader.pages[i]
+    def close(self) -> None:
+        self._stream.close()
+
+def open_pdf(src: Path | bytes):
+    # Accept either a path on disk or the raw upload bytes.
+    if fitz is None:
+        return _PypdfDocument(src)
+    if isinstance(src, (bytes, bytearray)):
+        return fitz.open(stream=src, filetype="pdf")
+    return fitz.open(str(src))
+
+def page_text(page) -> str:
+    try:
+        return (page.get_text("text") if fitz is not None else page.extract_text()) or ""
+    except Exception:
+        return ""
+
+def pages_lines(doc, start: int, stop: int, deadline: float) -> tuple[list[str], int]:
+    # Normalised, non-empty lines of pages [start, stop), plus how many pages
+    # were read before the deadline (a time.monotonic() value). Pages are
+    # normalised as they are read so the raw page text never accumulates.
+    out = []
+    for i in range(start, stop):
+        if time.monotonic() > deadline:
+            return out, i - start
+        for ln in page_text(doc[i]).splitlines():
+            ln = norm_ws(ln)
+            if ln: out.append(ln)
+    return out, stop - start
+
+def extract_pages(data: bytes, start: int, stop: int, deadline: float) -> tuple[list[str], int]:
+    # Runs in a page-pool worker process, so it reopens the document from bytes.
+    doc = open_pdf(data)
+    try:
+        return pages_lines(doc, start, stop, deadline)
+    finally:
+        doc.close()
+
+def warm() -> None:
+    # Submitted once per worker at startup; importing this module is the work.
+    pass
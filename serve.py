@@ -0,0 +1,18 @@
+# Development/single-host launcher: python serve.py
+# Production alternative: WEB_CONCURRENCY=N gunicorn -k uvicorn.workers.UvicornWorker -w N app:app
+# Kept out of app.py on purpose: processes started with spawn/forkserver (uvicorn
+# workers, the PDF page pool) re-import the main module, and this one is light.
+import os, sys
+
+if __name__ == "__main__":
+    import uvicorn
+    # Exported so the worker processes, which import app afresh, see the real count.
+    workers = int(os.environ.setdefault("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+    uvicorn.run(
+        "app:app",
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8000")),
+        workers=workers,
+        loop="uvloop" if sys.platform != "win32" else "auto",
+        http="httptools",
+    )